@@ -16,45 +16,106 @@ distribution.  Practices above or below the 99.8% limit are labelled
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Tuple
 
 import pandas as pd
 import numpy as np
 
+try:
+    import duckdb
+except ImportError:  # optional fast path; the pandas route still works
+    duckdb = None
 
-def compute_metrics(df: pd.DataFrame) -> pd.DataFrame:
-    """Compute prescribing rates and outlier flags.
+try:
+    from numba import njit, prange
+except ImportError:  # optional; the NumPy route below gives the same results
+    njit = None
+
+METRIC_COLUMNS = [
+    "practice_code", "total_items", "total_list_size",
+    "rate_per_1000", "outlier",
+]
+
+LIMIT_COLUMNS = ["size", "ucl95", "lcl95", "ucl998", "lcl998"]
+
+#: Number of points in the log-spaced size grid for the limit curves.
+LIMIT_GRID_POINTS = 128
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _classify_kernel(size_k, rate, mean_rate):
+        """Fused outlier-classification pass over per-practice arrays.
+
+        One parallel loop computes each practice's exact 99.8% thresholds
+        transiently and emits the outlier code (0 = none, 1 = high,
+        2 = low), touching the arrays once with SIMD sqrt.  The limits are
+        not stored per practice — the curves live on a sparse grid.
+        """
+        n = size_k.shape[0]
+        outlier = np.zeros(n, dtype=np.int8)
+        for i in prange(n):
+            s = size_k[i]
+            if s > 0:
+                se = np.sqrt(mean_rate / s)
+                if rate[i] > mean_rate + 3.09 * se:
+                    outlier[i] = 1
+                elif rate[i] < mean_rate - 3.09 * se:
+                    outlier[i] = 2
+        return outlier
+else:
+    _classify_kernel = None
+
+
+def _limits_grid(sizes: np.ndarray, mean_rate: float) -> pd.DataFrame:
+    """Control-limit curves sampled on a sparse log-spaced size grid.
+
+    The funnel shape depends only on list size, so rather than storing
+    four limit values per practice the curves are evaluated once on
+    ``LIMIT_GRID_POINTS`` geometrically spaced sizes spanning the observed
+    range.  ``size`` is in patients, matching the funnel plot's x-axis.
+    """
+    positive = sizes[sizes > 0]
+    if positive.size == 0 or np.isnan(mean_rate):
+        return pd.DataFrame(columns=LIMIT_COLUMNS)
+    grid = np.geomspace(positive.min(), positive.max(), LIMIT_GRID_POINTS)
+    se = np.sqrt(mean_rate / (grid / 1000.0))
+    return pd.DataFrame({
+        "size": grid,
+        "ucl95": mean_rate + 1.96 * se,
+        "lcl95": mean_rate - 1.96 * se,
+        "ucl998": mean_rate + 3.09 * se,
+        "lcl998": mean_rate - 3.09 * se,
+    })
+
+
+def _finalize_metrics(
+    grouped: pd.DataFrame,
+) -> tuple[pd.DataFrame, float, pd.DataFrame]:
+    """Add rates and outlier flags to practice totals.
 
     Parameters
     ----------
-    df: pandas.DataFrame
-        Tidy DataFrame with columns: practice_code, month, items, list_size.
+    grouped: pandas.DataFrame
+        One row per practice with columns: practice_code, total_items,
+        total_list_size.
 
     Returns
     -------
-    pandas.DataFrame
-        DataFrame with practice-level metrics: total_items, total_list_size,
-        rate_per_1000, mean_rate, ucl95, ucl998, lcl95, lcl998, outlier.
+    tuple of (pandas.DataFrame, float, pandas.DataFrame)
+        The input frame extended with rate_per_1000 and the outlier flag,
+        the overall mean rate as a scalar, and the control-limit curves
+        sampled on a sparse size grid (see ``_limits_grid``).  Neither the
+        mean nor the limits are broadcast into per-practice columns —
+        classification still uses each practice's exact thresholds, but
+        only the flag is stored.
     """
-    if df.empty:
-        return pd.DataFrame(columns=[
-            "practice_code", "total_items", "total_list_size",
-            "rate_per_1000", "mean_rate", "ucl95", "ucl998",
-            "lcl95", "lcl998", "outlier"
-        ])
-
-    # Filter out rows without list size or items
-    df = df.dropna(subset=["items"]).copy()
-    df["list_size"] = df.get("list_size").fillna(0)
-    # Convert to numeric
-    df["items"] = pd.to_numeric(df["items"], errors="coerce").fillna(0)
-    df["list_size"] = pd.to_numeric(df["list_size"], errors="coerce").fillna(0)
-
-    # Aggregate by practice
-    grouped = df.groupby("practice_code").agg(
-        total_items=("items", "sum"),
-        total_list_size=("list_size", "sum")
-    ).reset_index()
+    if grouped.empty:
+        return (
+            pd.DataFrame(columns=METRIC_COLUMNS),
+            float("nan"),
+            pd.DataFrame(columns=LIMIT_COLUMNS),
+        )
+
     # Compute rate per 1000 patients
     grouped["rate_per_1000"] = np.where(
         grouped["total_list_size"] > 0,
@@ -65,58 +126,249 @@ def compute_metrics(df: pd.DataFrame) -> pd.DataFrame:
     # Overall mean rate across all practices
     mean_rate = grouped["rate_per_1000"].mean(skipna=True)
 
-    # Compute control limits: for funnel plot, approximate variance = mean_rate/size
-    def limits(size: float, z: float) -> Tuple[float, float]:
-        if size <= 0 or np.isnan(mean_rate):
-            return (np.nan, np.nan)
-        se = np.sqrt(mean_rate / size)
-        return (
-            mean_rate + z * se,
-            mean_rate - z * se,
+    # Classify outliers against each practice's exact 99.8% thresholds
+    # (variance approximated as mean_rate/size); the thresholds themselves
+    # are transient and never stored per practice.
+    size = grouped["total_list_size"].to_numpy(dtype=np.float64) / 1000.0
+    rate = grouped["rate_per_1000"].to_numpy(dtype=np.float64)
+
+    if _classify_kernel is not None and not np.isnan(mean_rate):
+        # Single fused pass over the arrays (SIMD sqrt, threaded).
+        flags = _classify_kernel(size, rate, float(mean_rate))
+        grouped["outlier"] = np.array(["", "high", "low"], dtype=object)[flags]
+    else:
+        valid = size > 0
+        se = np.sqrt(mean_rate / np.where(valid, size, 1.0))
+        grouped["outlier"] = np.select(
+            [valid & (rate > mean_rate + 3.09 * se),
+             valid & (rate < mean_rate - 3.09 * se)],
+            ["high", "low"],
+            default="",
         )
 
-    ucl95, lcl95, ucl998, lcl998 = [], [], [], []
-    for _, row in grouped.iterrows():
-        upper95, lower95 = limits(row["total_list_size"] / 1000.0, 1.96)
-        upper998, lower998 = limits(row["total_list_size"] / 1000.0, 3.09)
-        ucl95.append(upper95)
-        lcl95.append(lower95)
-        ucl998.append(upper998)
-        lcl998.append(lower998)
-
-    grouped["mean_rate"] = mean_rate
-    grouped["ucl95"] = ucl95
-    grouped["lcl95"] = lcl95
-    grouped["ucl998"] = ucl998
-    grouped["lcl998"] = lcl998
-
-    # Determine outliers
-    def classify(row):
-        rate = row["rate_per_1000"]
-        if np.isnan(rate):
-            return ""
-        if rate > row["ucl998"]:
-            return "high"
-        if rate < row["lcl998"]:
-            return "low"
-        return ""
-
-    grouped["outlier"] = grouped.apply(classify, axis=1)
+    limits = _limits_grid(
+        grouped["total_list_size"].to_numpy(dtype=np.float64), float(mean_rate)
+    )
+    return grouped, float(mean_rate), limits
+
+
+def _duckdb_source(tidy_path: Path) -> str:
+    """Pick the DuckDB table function matching the tidy file format."""
+    return "read_parquet(?)" if tidy_path.suffix == ".parquet" else "read_csv_auto(?)"
+
+
+def aggregate_duckdb(tidy_path: Path) -> pd.DataFrame:
+    """Aggregate the tidy CSV to practice totals inside DuckDB.
 
+    DuckDB scans and hash-aggregates the file with a multi-threaded C++
+    engine, so the per-row data never materialises in pandas.  The filters
+    mirror ``compute_metrics``: rows without items or a practice code are
+    dropped and missing list sizes count as zero.
+    """
+    query = f"""
+        SELECT practice_code,
+               SUM(TRY_CAST(items AS DOUBLE)) AS total_items,
+               COALESCE(SUM(TRY_CAST(list_size AS DOUBLE)), 0) AS total_list_size
+        FROM {_duckdb_source(tidy_path)}
+        WHERE practice_code IS NOT NULL
+          AND TRY_CAST(items AS DOUBLE) IS NOT NULL
+        GROUP BY practice_code
+        ORDER BY practice_code
+    """
+    grouped = duckdb.execute(query, [str(tidy_path)]).df()
+    # Keep whole-number totals as integers, as the pandas path does.
+    for col in ("total_items", "total_list_size"):
+        vals = grouped[col].to_numpy()
+        if len(vals) and np.isfinite(vals).all() and (vals == np.rint(vals)).all():
+            grouped[col] = vals.astype(np.int64)
     return grouped
 
 
+def aggregate_monthly_duckdb(tidy_path: Path) -> pd.DataFrame:
+    """Aggregate the tidy CSV to monthly totals inside DuckDB."""
+    query = f"""
+        SELECT month,
+               SUM(TRY_CAST(items AS DOUBLE)) AS items,
+               COALESCE(SUM(TRY_CAST(list_size AS DOUBLE)), 0) AS list_size
+        FROM {_duckdb_source(tidy_path)}
+        WHERE month IS NOT NULL
+          AND TRY_CAST(items AS DOUBLE) IS NOT NULL
+        GROUP BY month
+        ORDER BY month
+    """
+    return duckdb.execute(query, [str(tidy_path)]).df()
+
+
+def _monthly_rate(monthly: pd.DataFrame) -> pd.DataFrame:
+    """Add the population rate per 1 000 patients to monthly totals."""
+    monthly["rate_per_1000"] = np.where(
+        monthly["list_size"] > 0,
+        monthly["items"] / monthly["list_size"] * 1000.0,
+        np.nan,
+    )
+    return monthly
+
+
+def _grouped_sums(keys: pd.Series, values: pd.DataFrame) -> pd.DataFrame:
+    """Sum each column of ``values`` per unique key with np.bincount.
+
+    One O(N) C-level pass per column over int category codes — no hash
+    table, no agg machinery.  Rows with missing keys are dropped and NaN
+    values count as zero.
+    """
+    cat = pd.Categorical(keys)
+    codes = cat.codes.astype(np.intp)
+    keyed = codes >= 0
+    n_groups = len(cat.categories)
+    data = {
+        col: np.bincount(
+            codes[keyed],
+            weights=np.nan_to_num(values[col].to_numpy(dtype=np.float64))[keyed],
+            minlength=n_groups,
+        )
+        for col in values.columns
+    }
+    return pd.DataFrame(data, index=pd.Index(np.asarray(cat.categories), name=keys.name))
+
+
+def aggregate_chunked(
+    tidy_path: Path, chunksize: int = 500_000
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Stream the tidy CSV and reduce it to practice and monthly totals.
+
+    Only the running totals survive between chunks, so peak memory is
+    O(practices + months) rather than O(rows).  The statistics we need are
+    plain sums, so merging two partial aggregates is elementwise addition —
+    the degenerate case of the parallel-moments update.
+    """
+    totals: pd.DataFrame | None = None
+    monthly: pd.DataFrame | None = None
+    for chunk in pd.read_csv(
+        tidy_path, chunksize=chunksize,
+        dtype={"practice_code": "category", "month": "category"},
+    ):
+        base = pd.DataFrame({
+            "practice_code": chunk["practice_code"],
+            "month": chunk["month"],
+            "items": pd.to_numeric(chunk["items"], errors="coerce"),
+            "list_size": pd.to_numeric(chunk["list_size"], errors="coerce").fillna(0),
+        }).dropna(subset=["items"])
+        part = _grouped_sums(base["practice_code"], base[["items", "list_size"]])
+        part_m = _grouped_sums(base["month"], base[["items", "list_size"]])
+        totals = part if totals is None else totals.add(part, fill_value=0)
+        monthly = part_m if monthly is None else monthly.add(part_m, fill_value=0)
+    if totals is None or totals.empty:
+        return (
+            pd.DataFrame(columns=["practice_code", "total_items", "total_list_size"]),
+            pd.DataFrame(columns=["month", "items", "list_size"]),
+        )
+    totals = totals.rename(
+        columns={"items": "total_items", "list_size": "total_list_size"}
+    )
+    totals = totals.rename_axis("practice_code").reset_index().sort_values(
+        "practice_code", ignore_index=True
+    )
+    monthly = monthly.rename_axis("month").reset_index().sort_values(
+        "month", ignore_index=True
+    )
+    return totals, monthly
+
+
+def compute_metrics(df: pd.DataFrame) -> tuple[pd.DataFrame, float, pd.DataFrame]:
+    """Compute prescribing rates and outlier flags.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Tidy DataFrame with columns: practice_code, month, items, list_size.
+
+    Returns
+    -------
+    tuple of (pandas.DataFrame, float, pandas.DataFrame)
+        DataFrame with practice-level metrics: total_items, total_list_size,
+        rate_per_1000, outlier; the overall mean rate as a scalar; and the
+        funnel control-limit curves on a sparse size grid.
+    """
+    if df.empty:
+        return (
+            pd.DataFrame(columns=METRIC_COLUMNS),
+            float("nan"),
+            pd.DataFrame(columns=LIMIT_COLUMNS),
+        )
+
+    # Coerce each numeric column once and mask out rows without items.
+    # Working on the extracted Series avoids copying the whole frame and
+    # the repeated fillna passes over the same column.
+    items = pd.to_numeric(df["items"], errors="coerce")
+    list_size = pd.to_numeric(df["list_size"], errors="coerce")
+    keep = items.notna().to_numpy()
+
+    # Aggregate by practice.  _grouped_sums factorises the key once and
+    # sums with np.bincount over the integer codes, avoiding per-row
+    # hashing of object-dtype strings inside groupby.
+    sums = _grouped_sums(
+        df["practice_code"][keep],
+        pd.DataFrame({"items": items[keep], "list_size": list_size[keep]}),
+    )
+    total_items = sums["items"].to_numpy()
+    total_list_size = sums["list_size"].to_numpy()
+    if pd.api.types.is_integer_dtype(items):
+        total_items = total_items.astype(np.int64)
+    if pd.api.types.is_integer_dtype(list_size):
+        total_list_size = total_list_size.astype(np.int64)
+    grouped = pd.DataFrame({
+        "practice_code": sums.index.to_numpy(),
+        "total_items": total_items,
+        "total_list_size": total_list_size,
+    })
+    return _finalize_metrics(grouped)
+
+
 def main() -> None:
     project_root = Path(__file__).resolve().parents[1]
     tidy_path = project_root / "data" / "tidy.csv"
-    if not tidy_path.exists():
+    tidy_parquet = project_root / "data" / "tidy.parquet"
+    # Prefer the Parquet sidecar from clean.py: typed columns, no re-parse.
+    source = tidy_parquet if tidy_parquet.exists() else tidy_path
+    if not source.exists():
         raise FileNotFoundError(
             f"{tidy_path} not found. Have you run clean.py?"
         )
-    df = pd.read_csv(tidy_path)
-    metrics = compute_metrics(df)
+    if duckdb is not None:
+        # Aggregate inside DuckDB: the monthly rows never enter pandas.
+        metrics, mean_rate, limits = _finalize_metrics(aggregate_duckdb(source))
+        monthly = _monthly_rate(aggregate_monthly_duckdb(source))
+    elif source.suffix == ".parquet":
+        # Column-pruned Parquet read, then the in-memory pandas path.
+        df = pd.read_parquet(
+            source, columns=["practice_code", "month", "items", "list_size"]
+        )
+        metrics, mean_rate, limits = compute_metrics(df)
+        monthly_base = pd.DataFrame({
+            "month": df["month"],
+            "items": pd.to_numeric(df["items"], errors="coerce"),
+            "list_size": pd.to_numeric(df["list_size"], errors="coerce").fillna(0),
+        }).dropna(subset=["items"])
+        monthly = _monthly_rate(
+            monthly_base
+            .groupby("month", observed=True, as_index=False)[["items", "list_size"]]
+            .sum()
+        )
+    else:
+        # Stream the CSV in chunks so only the running totals are ever
+        # resident, not the full monthly table.
+        practice_totals, monthly_totals = aggregate_chunked(source)
+        metrics, mean_rate, limits = _finalize_metrics(practice_totals)
+        monthly = _monthly_rate(monthly_totals)
     metrics_path = project_root / "data" / "metrics.csv"
     metrics.to_csv(metrics_path, index=False)
+    metrics.to_parquet(metrics_path.with_suffix(".parquet"), compression="zstd")
+    mean_rate_path = project_root / "data" / "mean_rate.csv"
+    pd.DataFrame({"mean_rate": [mean_rate]}).to_csv(mean_rate_path, index=False)
+    limits_path = project_root / "data" / "funnel_limits.csv"
+    limits.to_csv(limits_path, index=False)
+    monthly_path = project_root / "data" / "monthly.csv"
+    monthly.to_csv(monthly_path, index=False)
     print(f"Wrote metrics to {metrics_path} ({len(metrics)} rows)")
 
 
@@ -12,9 +12,17 @@ from __future__ import annotations
 
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import matplotlib
+
+matplotlib.use("Agg")  # headless raster backend; avoids GUI probing on servers
+
 import matplotlib.pyplot as plt
 
+# Let the Agg renderer coalesce near-collinear segments when stroking paths.
+plt.rcParams["path.simplify_threshold"] = 1.0
+
 
 def plot_trends(df: pd.DataFrame, output_dir: Path) -> None:
     """Plot national antibiotic prescribing trends over time.
@@ -24,19 +32,36 @@ def plot_trends(df: pd.DataFrame, output_dir: Path) -> None:
     df: pandas.DataFrame
         DataFrame containing at least ``month`` and ``rate_per_1000`` columns.
         Multiple rows per month (different practices) are allowed; values are
-        averaged across practices for plotting.
+        averaged across practices for plotting.  If a ``month_i`` column
+        (months since 2000-01, as written by ``clean.py``) is present, it is
+        grouped on directly, skipping the datetime reparse.
     output_dir: pathlib.Path
         Directory to save the figures.
     """
-    # Convert month to datetime
-    tmp = df.copy()
-    try:
-        tmp["month"] = pd.to_datetime(tmp["month"], format="%Y-%m")
-    except Exception:
-        tmp["month"] = pd.to_datetime(tmp["month"], errors="coerce")
-    trend_df = tmp.groupby("month")["rate_per_1000"].mean().reset_index()
+    if "month_i" in df.columns:
+        # Integer groupby on the cached month index; only the handful of
+        # unique monthly points are converted back to datetimes.
+        trend = df.groupby("month_i", observed=True)["rate_per_1000"].mean()
+        mi = trend.index.to_numpy(dtype="int64")
+        months = pd.to_datetime(pd.DataFrame({
+            "year": 2000 + (mi - 1) // 12,
+            "month": (mi - 1) % 12 + 1,
+            "day": 1,
+        }))
+    else:
+        # Group by the parsed month Series; no copy of the full frame.
+        try:
+            parsed = pd.to_datetime(df["month"], format="%Y-%m")
+        except Exception:
+            parsed = pd.to_datetime(df["month"], errors="coerce")
+        trend = df["rate_per_1000"].groupby(parsed).mean()
+        months = trend.index
+    # Hand matplotlib plain NumPy arrays so it skips the pandas unit
+    # conversion machinery.
+    x = np.asarray(months, dtype="datetime64[ns]")
+    y = trend.to_numpy(dtype=np.float64)
     fig, ax = plt.subplots()
-    ax.plot(trend_df["month"], trend_df["rate_per_1000"], label="Mean items per 1k patients")
+    ax.plot(x, y, label="Mean items per 1k patients")
     ax.set_xlabel("Month")
     ax.set_ylabel("Items per 1k patients")
     ax.set_title("National antibiotic prescribing trend")
@@ -46,7 +71,12 @@ def plot_trends(df: pd.DataFrame, output_dir: Path) -> None:
     plt.close(fig)
 
 
-def plot_funnel(df: pd.DataFrame, output_dir: Path) -> None:
+def plot_funnel(
+    df: pd.DataFrame,
+    output_dir: Path,
+    mean_rate: float | None = None,
+    limits: pd.DataFrame | None = None,
+) -> None:
     """Plot a funnel chart comparing practices.
 
     Each practice is represented by its total list size (denominator) and
@@ -56,25 +86,55 @@ def plot_funnel(df: pd.DataFrame, output_dir: Path) -> None:
     Parameters
     ----------
     df: pandas.DataFrame
-        DataFrame with columns ``total_list_size``, ``rate_per_1000``,
-        ``ucl95``, ``lcl95``, ``ucl998`` and ``lcl998``.
+        DataFrame with columns ``total_list_size`` and ``rate_per_1000``.
     output_dir: pathlib.Path
         Directory to save the figure.
+    mean_rate: float, optional
+        Overall mean prescribing rate to draw as a horizontal reference
+        line.  Falls back to a ``mean_rate`` column if present (older
+        metrics files carried the mean broadcast into every row).
+    limits: pandas.DataFrame, optional
+        Control-limit curves on a size grid with columns ``size``,
+        ``ucl95``, ``lcl95``, ``ucl998`` and ``lcl998``, as written by
+        ``analyze.py``.  When absent, per-practice limit columns in ``df``
+        are used instead (older metrics files).
     """
     if df.empty:
         return
+    all_sizes = df["total_list_size"].to_numpy(dtype=np.float64)
+    all_rates = df["rate_per_1000"].to_numpy(dtype=np.float64)
     fig, ax = plt.subplots()
-    # Scatter points
-    ax.scatter(df["total_list_size"], df["rate_per_1000"], s=10, alpha=0.6)
-    # Plot control limit lines
-    sizes = df["total_list_size"]
-    ax.plot(sizes, df["ucl95"], linestyle="--", label="95% upper limit")
-    ax.plot(sizes, df["lcl95"], linestyle="--", label="95% lower limit")
-    ax.plot(sizes, df["ucl998"], linestyle=":", label="99.8% upper limit")
-    ax.plot(sizes, df["lcl998"], linestyle=":", label="99.8% lower limit")
+    # Practice points.  Rasterize the markers (vector output stays small)
+    # and switch to a hexbin density view once individual markers would
+    # just overplot each other.
+    if len(df) > 5000:
+        ax.hexbin(all_sizes, all_rates, gridsize=60, mincnt=1, rasterized=True)
+    else:
+        ax.scatter(all_sizes, all_rates, s=10, alpha=0.6, rasterized=True)
+    # Control limit curves.  Prefer the sparse size-grid frame (already
+    # monotonic in size); fall back to per-practice limit columns sorted
+    # by list size for metrics files that still carry them.
+    if limits is not None and not limits.empty:
+        sizes = limits["size"].to_numpy(dtype=np.float64)
+        curves = limits
+        take = slice(None)
+    elif "ucl95" in df.columns:
+        order = np.argsort(all_sizes)
+        sizes = all_sizes[order]
+        curves = df
+        take = order
+    else:
+        curves = None
+    if curves is not None:
+        ax.plot(sizes, curves["ucl95"].to_numpy()[take], linestyle="--", label="95% upper limit")
+        ax.plot(sizes, curves["lcl95"].to_numpy()[take], linestyle="--", label="95% lower limit")
+        ax.plot(sizes, curves["ucl998"].to_numpy()[take], linestyle=":", label="99.8% upper limit")
+        ax.plot(sizes, curves["lcl998"].to_numpy()[take], linestyle=":", label="99.8% lower limit")
     # Mean line
-    if "mean_rate" in df.columns:
-        ax.axhline(df["mean_rate"].iloc[0], linestyle="-.", label="Mean rate")
+    if mean_rate is None and "mean_rate" in df.columns:
+        mean_rate = df["mean_rate"].iloc[0]
+    if mean_rate is not None and not pd.isna(mean_rate):
+        ax.axhline(mean_rate, linestyle="-.", label="Mean rate")
     ax.set_xlabel("Total list size (patients)")
     ax.set_ylabel("Items per 1k patients")
     ax.set_title("Funnel plot of practice prescribing rates")
@@ -87,17 +147,34 @@ def plot_funnel(df: pd.DataFrame, output_dir: Path) -> None:
 def main() -> None:
     project_root = Path(__file__).resolve().parents[1]
     metrics_path = project_root / "data" / "metrics.csv"
-    if not metrics_path.exists():
+    metrics_parquet = project_root / "data" / "metrics.parquet"
+    if metrics_parquet.exists():
+        df = pd.read_parquet(metrics_parquet)
+    elif metrics_path.exists():
+        df = pd.read_csv(metrics_path, engine="pyarrow", dtype={"practice_code": "category"})
+    else:
         raise FileNotFoundError(
             f"{metrics_path} not found. Have you run analyze.py?"
         )
-    df = pd.read_csv(metrics_path)
     output_dir = project_root / "outputs" / "figures"
-    # Plot national trend using monthly average rates.  To avoid double counting,
-    # convert metrics back to monthly using tidy file if available.
+    # Plot national trend using monthly rates.  Prefer the monthly aggregate
+    # written by analyze.py: it is a few dozen rows, so no per-row re-divide
+    # or re-load of the tidy file is needed.
+    monthly_path = project_root / "data" / "monthly.csv"
     tidy_path = project_root / "data" / "tidy.csv"
-    if tidy_path.exists():
-        tidy_df = pd.read_csv(tidy_path)
+    tidy_parquet = project_root / "data" / "tidy.parquet"
+    if monthly_path.exists():
+        monthly_df = pd.read_csv(monthly_path)
+        plot_trends(monthly_df, output_dir)
+    elif tidy_parquet.exists() or tidy_path.exists():
+        if tidy_parquet.exists():
+            tidy_df = pd.read_parquet(tidy_parquet)
+        else:
+            tidy_df = pd.read_csv(
+                tidy_path,
+                engine="pyarrow",
+                dtype={"practice_code": "category", "month": "category", "bnf_code": "category"},
+            )
         # Merge list size into tidy if available
         if "list_size" not in tidy_df.columns:
             tidy_df = tidy_df.merge(
@@ -111,8 +188,20 @@ def main() -> None:
         df_trend = df.copy()
         # Without month, can't produce monthly trend; skip.
         pass
-    # Funnel plot
-    plot_funnel(df, output_dir)
+    # Funnel plot.  The overall mean rate lives in its own one-row file
+    # rather than being broadcast down a metrics column, and the control
+    # limit curves in a small size-grid file.
+    mean_rate = None
+    mean_rate_path = project_root / "data" / "mean_rate.csv"
+    if mean_rate_path.exists():
+        mean_rate_df = pd.read_csv(mean_rate_path)
+        if "mean_rate" in mean_rate_df.columns and not mean_rate_df.empty:
+            mean_rate = float(mean_rate_df["mean_rate"].iloc[0])
+    limits = None
+    limits_path = project_root / "data" / "funnel_limits.csv"
+    if limits_path.exists():
+        limits = pd.read_csv(limits_path)
+    plot_funnel(df, output_dir, mean_rate=mean_rate, limits=limits)
     print(f"Saved figures to {output_dir}")
 
 
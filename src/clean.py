@@ -17,20 +17,68 @@ from pathlib import Path
 from typing import Dict, List
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
 import yaml
 
 
 def _read_config(config_path: Path) -> List[Dict[str, str]]:
+    # Plain csv.reader with fixed column indices: one tuple per row
+    # instead of a per-row dict with per-cell name lookups.
     rows: List[Dict[str, str]] = []
     with config_path.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader((row for row in f if not row.startswith("#")))
+        reader = csv.reader(row for row in f if not row.startswith("#"))
+        header = next(reader, None)
+        if header is None:
+            return rows
+        try:
+            indices = [header.index(name) for name in ("month", "file_name", "type")]
+        except ValueError:
+            return rows
+        width = max(indices) + 1
         for row in reader:
-            if not all(k in row for k in ("month", "file_name", "type")):
+            if len(row) < width:
                 continue
-            rows.append(row)
+            rows.append({
+                "month": row[indices[0]],
+                "file_name": row[indices[1]],
+                "type": row[indices[2]],
+            })
     return rows
 
 
+def _filter_antibiotics(table: pa.Table) -> pa.Table:
+    """Keep rows whose BNF code starts with 0501 (oral antibacterials).
+
+    The prefix compare runs as an Arrow compute kernel over the raw
+    column buffers, so non-antibiotic rows are dropped before anything is
+    concatenated or converted to pandas.
+    """
+    if "bnf_code" not in table.column_names:
+        return table
+    codes = pc.cast(table["bnf_code"], pa.string())
+    return table.filter(pc.starts_with(codes, pattern="0501"))
+
+
+def _merge_on_codes(left: pd.DataFrame, right: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """Left-merge two frames on integer codes for ``keys``.
+
+    Factorising the concatenated key values gives both frames the same
+    int codes, so the join hashes small integers instead of object-dtype
+    strings.  The code columns are internal and dropped from the result.
+    """
+    left = left.copy(deep=False)
+    right = right.copy(deep=False)
+    code_cols = [f"_{key}_code" for key in keys]
+    for key, code_col in zip(keys, code_cols):
+        codes = pd.factorize(pd.concat([left[key], right[key]], ignore_index=True))[0]
+        left[code_col] = codes[: len(left)]
+        right[code_col] = codes[len(left):]
+    merged = left.merge(right.drop(columns=keys), on=code_cols, how="left")
+    return merged.drop(columns=code_cols)
+
+
 def _load_column_map(columns_path: Path) -> Dict[str, Dict[str, str]]:
     if not columns_path.exists():
         return {}
@@ -52,8 +100,8 @@ def main() -> None:
     presc_map = column_map.get("prescribing", {})
     list_map = column_map.get("list_size", {})
 
-    prescribing_frames: List[pd.DataFrame] = []
-    list_frames: List[pd.DataFrame] = []
+    prescribing_tables: List[pa.Table] = []
+    list_tables: List[pa.Table] = []
 
     for row in config_rows:
         month = row.get("month")
@@ -66,35 +114,52 @@ def main() -> None:
             print(f"Warning: raw file {file_path} not found; skipping")
             continue
         try:
-            df = pd.read_csv(file_path)
+            # Arrow parses each CSV with multiple threads and keeps the
+            # columns as Arrow buffers until the single concat below.
+            table = pa_csv.read_csv(file_path)
         except Exception as exc:
             print(f"Warning: failed to read {file_path}: {exc}")
             continue
         # Standardise column names
         if ftype == "prescribing":
-            rename_dict = {v: k for k, v in presc_map.items() if v in df.columns}
-            df = df.rename(columns=rename_dict)
+            renames = {v: k for k, v in presc_map.items()}
+            table = table.rename_columns([renames.get(c, c) for c in table.column_names])
             # Add month if not present
-            if "month" not in df.columns:
-                df["month"] = month
-            # Filter to antibiotics (BNF code starting with 0501) if column exists
-            if "bnf_code" in df.columns:
-                df = df[df["bnf_code"].astype(str).str.startswith("0501")]
-            prescribing_frames.append(df[[c for c in df.columns if c in {"practice_code", "month", "items", "bnf_code"} or c not in {"practice_code", "month", "items", "bnf_code"}]].copy())
+            if "month" not in table.column_names:
+                table = table.append_column(
+                    "month", pa.array([month] * table.num_rows, type=pa.string())
+                )
+            # Filter to antibiotics before the table is concatenated, and
+            # keep only the columns the tidy output needs so stray columns
+            # in individual monthly files never reach the concat.
+            table = _filter_antibiotics(table)
+            keep = [c for c in table.column_names
+                    if c in {"practice_code", "month", "items", "bnf_code"}]
+            prescribing_tables.append(table.select(keep))
         elif ftype == "list_size":
-            rename_dict = {v: k for k, v in list_map.items() if v in df.columns}
-            df = df.rename(columns=rename_dict)
-            if "month" not in df.columns:
-                df["month"] = month
-            list_frames.append(df[[c for c in df.columns if c in {"practice_code", "month", "list_size"}]].copy())
-
-    # Concatenate data
-    presc_df = pd.concat(prescribing_frames, ignore_index=True) if prescribing_frames else pd.DataFrame()
-    list_df = pd.concat(list_frames, ignore_index=True) if list_frames else pd.DataFrame()
+            renames = {v: k for k, v in list_map.items()}
+            table = table.rename_columns([renames.get(c, c) for c in table.column_names])
+            if "month" not in table.column_names:
+                table = table.append_column(
+                    "month", pa.array([month] * table.num_rows, type=pa.string())
+                )
+            keep = [c for c in table.column_names
+                    if c in {"practice_code", "month", "list_size"}]
+            list_tables.append(table.select(keep))
+
+    # Concatenate once in Arrow (zero-copy) and convert to pandas once
+    presc_df = (
+        pa.concat_tables(prescribing_tables, promote_options="default").to_pandas()
+        if prescribing_tables else pd.DataFrame()
+    )
+    list_df = (
+        pa.concat_tables(list_tables, promote_options="default").to_pandas()
+        if list_tables else pd.DataFrame()
+    )
 
     # Merge prescribing with list size
     if not presc_df.empty and not list_df.empty:
-        tidy = presc_df.merge(list_df, on=["practice_code", "month"], how="left")
+        tidy = _merge_on_codes(presc_df, list_df, ["practice_code", "month"])
     else:
         tidy = presc_df if not presc_df.empty else pd.DataFrame(columns=["practice_code", "month", "items", "list_size"])
 
@@ -104,11 +169,24 @@ def main() -> None:
             imd_df = pd.read_csv(imd_path)
             # Expect columns practice_code, imd_quintile
             if {"practice_code", "imd_quintile"}.issubset(imd_df.columns):
-                tidy = tidy.merge(imd_df[["practice_code", "imd_quintile"]], on="practice_code", how="left")
+                tidy = _merge_on_codes(
+                    tidy, imd_df[["practice_code", "imd_quintile"]], ["practice_code"]
+                )
         except Exception as exc:
             print(f"Warning: failed to read IMD lookup: {exc}")
 
+    # Cache the parsed month as a small integer (months since 2000-01) so
+    # downstream steps can group on ints instead of reparsing the strings.
+    if not tidy.empty and "month" in tidy.columns:
+        month_dt = pd.to_datetime(tidy["month"], format="%Y-%m", errors="coerce")
+        tidy["month_i"] = (
+            (month_dt.dt.year - 2000) * 12 + month_dt.dt.month
+        ).astype("Int32")
+
     tidy.to_csv(tidy_path, index=False)
+    # Parquet sidecar: typed columns and compression make reruns of the
+    # analyze/chart steps much cheaper than re-parsing the CSV.
+    tidy.to_parquet(tidy_path.with_suffix(".parquet"), compression="zstd")
     print(f"Wrote tidy data to {tidy_path} ({len(tidy)} rows)")
 
 
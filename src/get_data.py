@@ -22,6 +22,8 @@ into `data/raw/` with the specified file_name.
 from __future__ import annotations
 
 import csv
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
 from pathlib import Path
 from typing import Iterable
 
@@ -32,32 +34,57 @@ def _read_config(config_path: Path) -> Iterable[dict[str, str]]:
     """Yield configuration rows from a CSV file.
 
     Each row is returned as a dictionary with keys: month, url, file_name, type.
-    Rows with missing headers are skipped.
+    Rows with missing headers are skipped.  Columns are located once from
+    the header and read by position, rather than building a dict per row.
     """
     with config_path.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader((row for row in f if not row.startswith("#")))
+        reader = csv.reader(row for row in f if not row.startswith("#"))
+        header = next(reader, None)
+        if header is None:
+            return
+        try:
+            indices = [header.index(name)
+                       for name in ("month", "url", "file_name", "type")]
+        except ValueError:
+            return
+        width = max(indices) + 1
         for row in reader:
-            # ensure required fields exist
-            if not all(key in row for key in ("month", "url", "file_name", "type")):
+            if len(row) < width:
                 continue
-            yield row
+            yield {
+                "month": row[indices[0]],
+                "url": row[indices[1]],
+                "file_name": row[indices[2]],
+                "type": row[indices[3]],
+            }
 
 
 def download_file(url: str, dest: Path) -> None:
     """Download a file from ``url`` and save it to ``dest``.
 
-    If the URL is empty or None, the download is skipped.  Existing files are
-    overwritten.
+    If the URL is empty or None, the download is skipped.  The response is
+    streamed to disk in 1 MiB chunks rather than buffered whole in memory.
+    When ``dest`` already exists an ``If-Modified-Since`` header is sent so
+    servers that honour it can answer 304 and the local copy is kept;
+    otherwise existing files are overwritten.
     """
     if not url:
         print(f"No URL provided for {dest.name}; skipping download.")
         return
     try:
+        headers = {}
+        if dest.exists():
+            headers["If-Modified-Since"] = formatdate(dest.stat().st_mtime, usegmt=True)
         print(f"Fetching {url} → {dest}…")
-        resp = requests.get(url, timeout=60)
-        resp.raise_for_status()
-        dest.parent.mkdir(parents=True, exist_ok=True)
-        dest.write_bytes(resp.content)
+        with requests.get(url, stream=True, timeout=60, headers=headers) as resp:
+            if resp.status_code == 304:
+                print(f"{dest.name} unchanged on server; keeping local copy.")
+                return
+            resp.raise_for_status()
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            with dest.open("wb") as out:
+                for chunk in resp.iter_content(chunk_size=1 << 20):
+                    out.write(chunk)
     except Exception as exc:
         print(f"Warning: failed to download {url}: {exc}")
 
@@ -69,15 +96,20 @@ def main() -> None:
     raw_dir.mkdir(parents=True, exist_ok=True)
     if not config_path.exists():
         raise FileNotFoundError(f"Configuration file not found: {config_path}")
-    for row in _read_config(config_path):
-        month = row.get("month")
-        url = row.get("url")
-        file_name = row.get("file_name")
-        if not file_name:
-            print(f"Skipping row for month {month} with no file_name")
-            continue
-        dest = raw_dir / file_name
-        download_file(url, dest)
+    # Downloads are network-bound, so fetch several files concurrently.
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = []
+        for row in _read_config(config_path):
+            month = row.get("month")
+            url = row.get("url")
+            file_name = row.get("file_name")
+            if not file_name:
+                print(f"Skipping row for month {month} with no file_name")
+                continue
+            dest = raw_dir / file_name
+            futures.append(pool.submit(download_file, url, dest))
+        for future in futures:
+            future.result()
     print(f"Finished downloading files into {raw_dir}")
 
 